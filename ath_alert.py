@@ -1,10 +1,17 @@
 import yfinance as yf
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import csv
+import json
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import config
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # ==============================================================
 # TELEGRAM CONFIG
@@ -12,8 +19,53 @@ import time
 TELEGRAM_BOT_TOKEN = config.BOT_TOKEN
 TELEGRAM_CHAT_ID = config.CHAT_ID
 
+# Shared session so every send reuses the same keep-alive connection to Telegram.
+# sendMessage is not idempotent, so POST is only retried on connect errors (request never
+# reached Telegram); read timeouts and 5xx could duplicate a delivered message. 429 is
+# handled in send_telegram_alert.
+TG_SESSION = requests.Session()
+TG_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=10,
+    max_retries=Retry(
+        total=3,
+        connect=3,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=0.5,
+        allowed_methods=frozenset(["POST"]),
+        raise_on_status=False,
+    ),
+))
+
+# Telegram allows ~1 message per second per chat; pace sends client-side
+TG_MIN_INTERVAL_SECONDS = 1.0
+# Attempts per message when Telegram answers 429 (waits its retry_after between attempts)
+TG_MAX_ATTEMPTS = 3
+
+# Telegram rejects messages longer than this many characters
+TG_MAX_MESSAGE_LEN = 4096
+
+_tg_lock = threading.Lock()
+_tg_last_send = 0.0
+
 # Path for storing log data
 LOG_FILE = "ath_alert_log.csv"
+LOG_FIELDS = ["timestamp", "symbol", "current_price", "ath", "diff_percent", "candles_since_ath", "alert_sent"]
+
+# Per-symbol ATH checkpoints, so later runs only download recent candles
+ATH_STATE_FILE = "ath_state.json"
+
+# Re-download full history when a checkpoint is this many days old
+# (backstop; rebased prices are detected via the checkpoint's reference close)
+ATH_STATE_MAX_AGE_DAYS = 7
+
+# Relative tolerance when comparing a checkpoint's reference close with the re-downloaded one
+PRICE_BASIS_RTOL = 1e-4
+
+# History downloaded for symbols with a fresh checkpoint
+RECENT_PERIOD = "1mo"
 
 # Alert threshold (percent distance from ATH). Set to 2.0 for 2%.
 THRESHOLD_PCT = 2.0
@@ -21,13 +73,40 @@ THRESHOLD_PCT = 2.0
 # Minimum number of candles since the most recent ATH (require ATH to be older than this)
 MIN_CANDLES_SINCE_ATH = 10
 
+# Columns kept from the download (High for ATH, Close for current price)
+PRICE_COLUMNS = ["High", "Close"]
+
+# Max symbols per yf.download request (Yahoo caps symbols per request)
+DOWNLOAD_CHUNK_SIZE = 20
+
+# Worker threads for per-symbol checks (controls throughput instead of sleeping)
+MAX_WORKERS = 8
+
+
+def wait_for_telegram_slot():
+    """Block until TG_MIN_INTERVAL_SECONDS have passed since the previous send (thread-safe)."""
+    global _tg_last_send
+    with _tg_lock:
+        wait = _tg_last_send + TG_MIN_INTERVAL_SECONDS - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _tg_last_send = time.monotonic()
+
 
 def send_telegram_alert(message: str):
     """Send alert message to Telegram."""
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message}
     try:
-        response = requests.post(url, data=payload, timeout=15)
+        for attempt in range(1, TG_MAX_ATTEMPTS + 1):
+            wait_for_telegram_slot()
+            response = TG_SESSION.post(url, data=payload, timeout=15)
+            if response.status_code != 429 or attempt == TG_MAX_ATTEMPTS:
+                break
+            retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+            print(f"⏳ Telegram rate limit hit, retrying in {retry_after}s...")
+            time.sleep(retry_after + 0.1)
+
         if response.status_code == 200:
             print("✅ Telegram alert sent successfully!")
             return True
@@ -39,40 +118,194 @@ def send_telegram_alert(message: str):
         return False
 
 
-def append_to_csv(file_path, data_dict):
-    """Append a single record (dictionary) to CSV file."""
-    df = pd.DataFrame([data_dict])
-    file_exists = os.path.isfile(file_path)
-    if not file_exists:
-        df.to_csv(file_path, index=False)
-    else:
-        df.to_csv(file_path, mode="a", header=False, index=False)
+def format_alert_line(log_data):
+    """One summary line for a symbol that is near its ATH."""
+    return (
+        f"🚨 {log_data['symbol']} | Current: {log_data['current_price']:.2f} | ATH: {log_data['ath']:.2f} | "
+        f"Diff: {log_data['diff_percent']:.2f}% | Candles since ATH: {log_data['candles_since_ath']}"
+    )
+
+
+def split_message(lines, limit=TG_MAX_MESSAGE_LEN):
+    """
+    Join lines into as few messages as possible, each at most `limit` characters.
+    Returns a list of (message, line_indices) where line_indices is the range of `lines` it holds.
+    """
+    messages = []
+    current = ""
+    start = 0
+    for i, line in enumerate(lines):
+        candidate = f"{current}\n{line}" if current else line
+        if current and len(candidate) > limit:
+            messages.append((current, range(start, i)))
+            current = line
+            start = i
+        else:
+            current = candidate
+    if current:
+        messages.append((current, range(start, len(lines))))
+    return messages
+
+
+def open_log_writer(file_path):
+    """Open CSV file for buffered appending; writes the header if the file is new. Returns (file, writer)."""
+    new_file = not os.path.isfile(file_path)
+    f = open(file_path, "a", newline="", buffering=1 << 16)
+    writer = csv.DictWriter(f, fieldnames=LOG_FIELDS)
+    if new_file:
+        writer.writeheader()
+    return f, writer
+
+
+def is_valid_checkpoint(checkpoint):
+    """True if a checkpoint has every field with a usable value."""
+    try:
+        # float() accepts "nan"/"inf", which would never match a downloaded price
+        if not (np.isfinite(float(checkpoint["ath"])) and np.isfinite(float(checkpoint["ref_close"]))):
+            return False
+        int(checkpoint["candles_since_ath"])
+        for key in ("ath_date", "last_date", "ref_date", "full_history_date"):
+            datetime.strptime(checkpoint[key], "%Y-%m-%d")
+        return True
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def load_ath_state(file_path):
+    """
+    Load {symbol: checkpoint} from JSON file. Returns empty dict if missing or unreadable.
+    Invalid entries are dropped, so those symbols get a full-history download.
+    """
+    if not os.path.isfile(file_path):
+        return {}
+    try:
+        with open(file_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable ATH state {file_path}: {e}")
+        return {}
+    if not isinstance(state, dict):
+        print(f"⚠️ Ignoring malformed ATH state {file_path}")
+        return {}
+
+    valid = {symbol: cp for symbol, cp in state.items() if is_valid_checkpoint(cp)}
+    if len(valid) < len(state):
+        print(f"⚠️ Dropped {len(state) - len(valid)} invalid ATH checkpoints")
+    return valid
+
+
+def save_ath_state(file_path, state):
+    """Write {symbol: checkpoint} to JSON file."""
+    with open(file_path, "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+
+def is_checkpoint_fresh(checkpoint, today):
+    """True if the checkpoint's full-history download is recent enough to reuse."""
+    full_history_date = datetime.strptime(checkpoint["full_history_date"], "%Y-%m-%d").date()
+    return (today - full_history_date).days < ATH_STATE_MAX_AGE_DAYS
+
+
+def matches_checkpoint_basis(data, checkpoint):
+    """
+    True if `data` is on the same adjusted price basis as the checkpoint, i.e. its close on the
+    checkpoint's reference date is unchanged (a split or dividend rescales auto-adjusted history).
+    """
+    pos = data.index.strftime("%Y-%m-%d").get_indexer([checkpoint["ref_date"]])[0]
+    if pos < 0:
+        return False
+    return bool(np.isclose(data["Close"].iloc[pos], checkpoint["ref_close"], rtol=PRICE_BASIS_RTOL))
+
+
+def chunked(items, size):
+    """Yield successive lists of at most `size` items."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def download_history(symbols, period="max"):
+    """
+    Download daily history for several symbols in one request.
+    Returns a DataFrame with 2-level columns keyed by ticker at level 0.
+    """
+    return yf.download(
+        symbols,
+        period=period,
+        interval="1d",
+        group_by="ticker",
+        threads=True,
+        auto_adjust=True,
+        progress=False,
+    )
 
 
 # ==============================================================
-# STOCK CHECK (returns tuple: (symbol, is_alert_sent, log_record))
+# STOCK CHECK (returns tuple: (symbol, is_alert, log_record, checkpoint, report_lines))
 # ==============================================================
-def check_all_time_high_once(symbol: str, threshold_pct: float = THRESHOLD_PCT, min_candles_since_ath: int = MIN_CANDLES_SINCE_ATH):
+def check_all_time_high_once(symbol: str, data: pd.DataFrame, checkpoint: dict = None, threshold_pct: float = THRESHOLD_PCT, min_candles_since_ath: int = MIN_CANDLES_SINCE_ATH):
     """
-    Fetch historical data once, compute ATH and whether current price is within threshold_pct of ATH.
-    Only send alert if:
+    Compute ATH from pre-fetched history and whether current price is within threshold_pct of ATH.
+    `data` is one ticker's slice of the batch download (flat High/Close columns).
+    With a checkpoint, `data` only holds recent candles and the ATH is max(checkpoint ATH, recent High).
+    Only flag an alert if:
       - current_price < ATH (strictly less)
       - diff_percent <= threshold_pct
       - the most recent ATH occurred more than min_candles_since_ath candles ago
-    Returns: (symbol, alert_sent: bool, log_data: dict)
+    Alerts are not sent here; the caller batches flagged symbols into the summary message.
+    Nothing is printed here either (this runs in worker threads); the per-symbol report
+    lines are returned for the caller to print in order.
+    Returns: (symbol, is_alert: bool, log_data: dict, checkpoint: dict, report: list[str])
     """
+    # One timestamp per symbol, reused for the log row and checkpoint
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    report = []
     try:
-        data = yf.download(symbol, period="max", interval="1d", auto_adjust=True, progress=False)
-        if data.empty:
-            print(f"⚠️ No data found for {symbol}")
-            return symbol, False, None
+        if data is None or data.empty:
+            report.append(f"⚠️ No data found for {symbol}")
+            return symbol, False, None, None, report
+
+        # Plain numpy views; numpy scalars are floats, so no float() casts are needed below
+        h = data["High"].to_numpy(copy=False)
+        c = data["Close"].to_numpy(copy=False)
+        dates = data.index.strftime("%Y-%m-%d")
+
+        # Most recent high position: first max of the reversed array, mapped back.
+        # nanargmax skips missing candles the same way Series.max() did.
+        high_pos = len(h) - 1 - int(np.nanargmax(h[::-1]))
 
-        # Handle possible multi-index columns
-        if isinstance(data.columns, pd.MultiIndex):
-            data.columns = data.columns.get_level_values(0)
+        if checkpoint is None or h[high_pos] >= checkpoint["ath"]:
+            # ATH lies inside the downloaded candles
+            all_time_high = h[high_pos]
+            ath_date = dates[high_pos]
+            # candles since ATH: number of rows after high_pos until the latest row
+            candles_since_ath = len(h) - 1 - high_pos
+        else:
+            # ATH predates the downloaded candles: advance the checkpoint by the new rows
+            all_time_high = checkpoint["ath"]
+            ath_date = checkpoint["ath_date"]
+            candles_since_ath = checkpoint["candles_since_ath"] + int(np.count_nonzero(dates > checkpoint["last_date"]))
+
+        current_price = c[-1]
 
-        current_price = float(data["Close"].iloc[-1])
-        all_time_high = float(data["High"].max())
+        # Reference candle for detecting rebased prices next run: the last completed
+        # candle (the latest one may still be moving intraday) with a finite Close
+        completed = c[:-1] if len(c) > 1 else c
+        finite_pos = np.flatnonzero(np.isfinite(completed))
+
+        if len(finite_pos) == 0:
+            # No usable reference close: skip the checkpoint, next run downloads full history
+            new_checkpoint = None
+        else:
+            ref_pos = int(finite_pos[-1])
+            new_checkpoint = {
+                "ath": all_time_high,
+                "ath_date": ath_date,
+                "last_date": dates[-1],
+                "candles_since_ath": candles_since_ath,
+                "ref_date": dates[ref_pos],
+                "ref_close": c[ref_pos],
+                "full_history_date": checkpoint["full_history_date"] if checkpoint else now_str[:10],
+            }
 
         # percent below ATH (0 if at or above ATH)
         if current_price >= all_time_high:
@@ -80,22 +313,7 @@ def check_all_time_high_once(symbol: str, threshold_pct: float = THRESHOLD_PCT,
         else:
             diff_percent = ((all_time_high - current_price) / all_time_high) * 100
 
-        # Find most recent index (position) where High == ATH
-        ath_positions = data.index[data["High"] == all_time_high]
-        if len(ath_positions) == 0:
-            # unexpected but handle
-            candles_since_ath = None
-        else:
-            # most recent ATH occurrence
-            last_ath_index = ath_positions[-1]
-            # integer position of that index in the dataframe
-            last_ath_pos = data.index.get_loc(last_ath_index)
-            # candles since ATH: number of rows after last_ath_pos until the latest row
-            candles_since_ath = (len(data) - 1) - last_ath_pos
-
-        print(f"{symbol} | Current: {current_price:.2f} | ATH: {all_time_high:.2f} | Diff: {diff_percent:.2f}% | Candles since ATH: {candles_since_ath}")
-
-        alert_sent = False
+        report.append(f"{symbol} | Current: {current_price:.2f} | ATH: {all_time_high:.2f} | Diff: {diff_percent:.2f}% | Candles since ATH: {candles_since_ath}")
 
         # Conditions:
         # 1) current price strictly less than ATH
@@ -103,50 +321,38 @@ def check_all_time_high_once(symbol: str, threshold_pct: float = THRESHOLD_PCT,
         # 3) most recent ATH occurred more than min_candles_since_ath candles ago
         condition_price_below_ath = current_price < all_time_high
         condition_within_pct = diff_percent <= threshold_pct
-        condition_candles = (candles_since_ath is not None) and (candles_since_ath > min_candles_since_ath)
+        condition_candles = candles_since_ath > min_candles_since_ath
 
         should_alert = condition_price_below_ath and condition_within_pct and condition_candles
 
         if should_alert:
-            message = (
-                f"🚨 {symbol} is within {threshold_pct:.2f}% of its All-Time High (but below ATH)!\n"
-                f"Current Price: {current_price:.2f}\n"
-                f"ATH: {all_time_high:.2f}\n"
-                f"Difference from ATH: {diff_percent:.2f}%\n"
-                f"Candles since last ATH: {candles_since_ath}\n"
-                f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            )
-            alert_sent = send_telegram_alert(message)
+            report.append(f"🚨 Alert: {symbol} is within {threshold_pct:.2f}% of its All-Time High (but below ATH)")
         else:
-            # for debugging/logging, print which condition failed
+            # for debugging/logging, report which condition failed
             fail_reasons = []
             if not condition_price_below_ath:
                 fail_reasons.append("current >= ATH")
             if not condition_within_pct:
                 fail_reasons.append(f"diff_pct > {threshold_pct}")
             if not condition_candles:
-                if candles_since_ath is None:
-                    fail_reasons.append("no ATH position found")
-                else:
-                    fail_reasons.append(f"candles_since_ath <= {min_candles_since_ath}")
-            print(f"→ No alert for {symbol}. Reasons: {', '.join(fail_reasons)}")
+                fail_reasons.append(f"candles_since_ath <= {min_candles_since_ath}")
+            report.append(f"→ No alert for {symbol}. Reasons: {', '.join(fail_reasons)}")
 
         log_data = {
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "timestamp": now_str,
             "symbol": symbol,
             "current_price": current_price,
             "ath": all_time_high,
             "diff_percent": diff_percent,
             "candles_since_ath": candles_since_ath,
-            "alert_sent": alert_sent
+            "alert_sent": False  # set by the caller once the summary message is sent
         }
 
-        append_to_csv(LOG_FILE, log_data)
-        return symbol, alert_sent, log_data
+        return symbol, should_alert, log_data, new_checkpoint, report
 
     except Exception as e:
-        print(f"⚠️ Error fetching {symbol}: {e}")
-        return symbol, False, None
+        report.append(f"⚠️ Error checking {symbol}: {e}")
+        return symbol, False, None, None, report
 
 
 # ==============================================================
@@ -154,29 +360,102 @@ def check_all_time_high_once(symbol: str, threshold_pct: float = THRESHOLD_PCT,
 # ==============================================================
 if __name__ == "__main__":
     stock_list = config.NIFTY50_STOCKS  # e.g., ["RELIANCE.NS", "TCS.NS", "INFY.NS"]
-    alerted_symbols = []
+    alerts = []
+    log_records = []
     processed = 0
+    run_started = datetime.now()
+    run_started_str = run_started.strftime("%Y-%m-%d %H:%M:%S")
 
-    print(f"\n📈 Checking All-Time Highs — {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    # Symbols with a fresh checkpoint only need recent candles; the rest need full history
+    ath_state = load_ath_state(ATH_STATE_FILE)
+    today = run_started.date()
+    recent_symbols = [s for s in stock_list if s in ath_state and is_checkpoint_fresh(ath_state[s], today)]
+    recent_set = set(recent_symbols)
+    full_symbols = [s for s in stock_list if s not in recent_set]
+    download_plan = [
+        (batch, "max") for batch in chunked(full_symbols, DOWNLOAD_CHUNK_SIZE)
+    ] + [
+        (batch, RECENT_PERIOD) for batch in chunked(recent_symbols, DOWNLOAD_CHUNK_SIZE)
+    ]
+
+    print(f"\n📈 Checking All-Time Highs — {run_started_str}")
     print("======================================================\n")
 
-    for i, stock in enumerate(stock_list, 1):
-        print(f"[{i}/{len(stock_list)}] Scanning {stock}...")
-        symbol, alert_sent, log = check_all_time_high_once(stock, threshold_pct=THRESHOLD_PCT, min_candles_since_ath=MIN_CANDLES_SINCE_ATH)
-        processed += 1
-        if alert_sent:
-            alerted_symbols.append(stock)
-
-        # sleep 1s to avoid hitting rate limits
-        time.sleep(1)
-
-    # Summary message
-    summary_msg = (
-        f"✅ ATH Alert Summary ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})\n"
-        f"Total Stocks Checked: {processed}\n"
-        f"Alerts Sent: {len(alerted_symbols)}\n"
-        f"Stocks Alerted: {', '.join(alerted_symbols) if alerted_symbols else 'None'}"
-    )
-    send_telegram_alert(summary_msg)
+    # Downloads stay sequential (yf.download keeps shared module state and is already
+    # threaded internally); the per-symbol checks run in the pool so they overlap
+    # with the next chunk's download.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        futures = {}
+        rebased_symbols = []
+        while download_plan:
+            batch, period = download_plan.pop(0)
+            print(f"⬇️ Downloading {len(batch)} symbols (period={period})...")
+            try:
+                batch_data = download_history(batch, period=period)
+            except Exception as e:
+                print(f"⚠️ Error fetching batch {batch[0]}..{batch[-1]}: {e}")
+                batch_data = None
+
+            tickers = set(batch_data.columns.get_level_values(0)) if batch_data is not None else set()
+            for stock in batch:
+                # Only High (ATH) and Close (current price) are used; drop the other columns up front
+                df = batch_data[stock][PRICE_COLUMNS].dropna(how="all") if stock in tickers else None
+                checkpoint = ath_state.get(stock) if period == RECENT_PERIOD else None
+                if checkpoint is not None and df is not None and not df.empty and not matches_checkpoint_basis(df, checkpoint):
+                    print(f"🔁 {stock}: adjusted prices changed since checkpoint, re-downloading full history")
+                    rebased_symbols.append(stock)
+                    continue
+                fut = ex.submit(check_all_time_high_once, stock, df, checkpoint, threshold_pct=THRESHOLD_PCT, min_candles_since_ath=MIN_CANDLES_SINCE_ATH)
+                futures[fut] = stock
+
+            # Recent batches come last, so rebased symbols are queued for full history at the end
+            if not download_plan and rebased_symbols:
+                download_plan = [(b, "max") for b in chunked(rebased_symbols, DOWNLOAD_CHUNK_SIZE)]
+                rebased_symbols = []
+
+        # Collect in submission order; workers only return their report lines, so the
+        # main thread is the only one printing and the output stays readable
+        for fut in futures:
+            symbol, is_alert, log, checkpoint, report = fut.result()
+            processed += 1
+            print(f"[{processed}/{len(stock_list)}] Scanned {symbol}")
+            print("\n".join(report))
+            if log is not None:
+                log_records.append(log)
+            if checkpoint is not None:
+                ath_state[symbol] = checkpoint
+            if is_alert:
+                alerts.append(log)
+
+    save_ath_state(ATH_STATE_FILE, ath_state)
+
+    # Full-history, recent and rebased symbols are submitted in separate passes;
+    # restore stock_list order so the committed CSV and summary ties are deterministic
+    stock_order = {s: i for i, s in enumerate(stock_list)}
+    log_records.sort(key=lambda r: stock_order[r["symbol"]])
+    alerts.sort(key=lambda r: stock_order[r["symbol"]])
+
+    # Summary message with every near-ATH symbol (closest to ATH first), split to fit Telegram's limit
+    alerts.sort(key=lambda r: r["diff_percent"])
+    summary_lines = [
+        f"✅ ATH Alert Summary ({run_started_str})",
+        f"Total Stocks Checked: {processed}",
+        f"Stocks within {THRESHOLD_PCT:.2f}% of ATH: {len(alerts)}",
+    ]
+    # alerts[i] is rendered as summary_lines[header_len + i]
+    header_len = len(summary_lines)
+    summary_lines += [format_alert_line(r) for r in alerts] or ["Stocks Alerted: None"]
+    for summary_msg, line_indices in split_message(summary_lines):
+        if send_telegram_alert(summary_msg):
+            # alert_sent is True only for rows whose line was in a delivered message
+            for i in line_indices:
+                if header_len <= i < header_len + len(alerts):
+                    alerts[i - header_len]["alert_sent"] = True
+
+    log_file, log_writer = open_log_writer(LOG_FILE)
+    try:
+        log_writer.writerows(log_records)
+    finally:
+        log_file.close()
 
     print("\n✅ All stocks processed — results saved to:", LOG_FILE)